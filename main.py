@@ -1,16 +1,19 @@
 import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Annotated
 
+import aiosqlite
+import msgspec
+import orjson
 from fastapi import FastAPI, Depends, Query
 from fastapi.exceptions import RequestValidationError
-from sqlalchemy import Column, Integer, Text, String, text
+from fastapi.responses import ORJSONResponse
 
-from pydantic import BaseModel, constr
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from pydantic import BaseModel
 from starlette import status
 from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
@@ -19,35 +22,93 @@ from bleach import clean as sanitize_html
 import re
 
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
 # Environment variables and constants
 DB_PATH = os.getenv("DB_PATH", "reviews.db")
 MAX_REVIEW_LENGTH = int(os.getenv("MAX_REVIEW_LENGTH", 1000))
-positive_patterns = [r"\bхорош\w*", r"\bлюблю\w*", ]
-negative_patterns = [r"\bплох\w*", r"\bненавиж\w*", ]
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 500))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", 500))
+MAX_BULK_SIZE = int(os.getenv("MAX_BULK_SIZE", 1000))
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", 8192))
+# Largest value SQLite can bind as an INTEGER
+MAX_ID = 2 ** 63 - 1
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+RELOAD = os.getenv("RELOAD", "false").lower() in ("1", "true", "yes")
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+positive_patterns = [r"хорош", r"люблю", ]
+negative_patterns = [r"плох", r"ненавиж", ]
+# Trigger words are prefixes, so the trailing \w* never changes the outcome of a search
+positive_re = re.compile(r"\b(?:{})".format("|".join(positive_patterns)), re.IGNORECASE)
+# Finds the first trigger word of either kind in a single pass, the group name tells which one it is
+trigger_re = re.compile(r"\b(?:(?P<positive>{})|(?P<negative>{}))".format(
+    "|".join(positive_patterns), "|".join(negative_patterns)), re.IGNORECASE)
+# None of the trigger words can occur in a pure ASCII text when each of them has a non-ASCII letter
+ascii_is_neutral = not any(pattern.isascii() for pattern in positive_patterns + negative_patterns)
+# Characters that bleach strips, escapes or normalizes: text without them comes out of it unchanged
+markup_re = re.compile(r"[\x00-\x08\x0b-\x1f&<>]")
+sqlite_pragmas = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+]
 
 # Logger
+# Level names understood by both logging and uvicorn; uvicorn's TRACE sits below DEBUG
+log_levels = {"CRITICAL": logging.CRITICAL, "ERROR": logging.ERROR, "WARNING": logging.WARNING,
+              "INFO": logging.INFO, "DEBUG": logging.DEBUG, "TRACE": 5}
+if LOG_LEVEL not in log_levels:
+    raise ValueError(f"LOG_LEVEL must be one of {', '.join(log_levels)}, got {LOG_LEVEL!r}")
 logging.basicConfig(
-    level=logging.INFO,
+    level=log_levels[LOG_LEVEL],
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# DataBase
-engine = create_async_engine("sqlite+aiosqlite:///{DB_PATH}".format(DB_PATH=DB_PATH))
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-Base = declarative_base()
+# SQL
+schema_sql = [
+    """
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER NOT NULL PRIMARY KEY,
+        text TEXT NOT NULL,
+        sentiment VARCHAR(10) NOT NULL,
+        created_at VARCHAR(20) NOT NULL
+    )
+    """,
+    # id is the rowid, so an index of its own only cost an extra B-tree write per insert
+    "DROP INDEX IF EXISTS ix_reviews_id",
+    # Serves the sentiment filter together with its ORDER BY id and keyset cursor
+    "CREATE INDEX IF NOT EXISTS ix_reviews_sentiment_id ON reviews (sentiment, id)",
+]
+SELECT_REVIEWS_SQL = """
+    SELECT id, text, sentiment, created_at
+    FROM reviews
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+    """
+SELECT_REVIEWS_BY_SENTIMENT_SQL = """
+    SELECT id, text, sentiment, created_at
+    FROM reviews
+    WHERE sentiment = ? AND id > ?
+    ORDER BY id
+    LIMIT ?
+    """
 
-# Models
-class Review(Base):
-    __tablename__ = "reviews"
-    id = Column(Integer, primary_key=True, index=True)
-    text = Column(Text, nullable=False)
-    sentiment = Column(String(10), nullable=False)
-    created_at = Column(String(20), nullable=False)
+@lru_cache(maxsize=INSERT_BATCH_SIZE)
+def insert_reviews_sql(rows: int) -> str:
+    """Function that builds (once per batch size) an INSERT of the given number of reviews"""
+    return """
+        INSERT INTO reviews (text, sentiment, created_at)
+        VALUES {values}
+        RETURNING id
+        """.format(values=", ".join(["(?, ?, ?)"] * rows))
 
-class ReviewPOSTRequest(BaseModel):
-    text: constr(strip_whitespace=True, min_length=1, max_length=MAX_REVIEW_LENGTH)
+# Models
+# Length limits apply after stripping, so they are checked in check_review and only documented here
+class ReviewPOSTRequest(msgspec.Struct):
+    text: Annotated[str, msgspec.Meta(extra_json_schema={"minLength": 1, "maxLength": MAX_REVIEW_LENGTH})]
 
 class ReviewResponse(BaseModel):
     id: int
@@ -55,23 +116,145 @@ class ReviewResponse(BaseModel):
     sentiment: str
     created_at: str
 
-async def get_db() -> AsyncSession:
-    """A function that opens a connection to a database for subsequent work with it."""
-    async with async_session() as session:
-        yield session
+review_decoder = msgspec.json.Decoder(ReviewPOSTRequest)
+reviews_decoder = msgspec.json.Decoder(list[ReviewPOSTRequest])
+review_schema = msgspec.json.schema_components([ReviewPOSTRequest])[1]["ReviewPOSTRequest"]
+reviews_schema = {"type": "array", "items": review_schema, "minItems": 1, "maxItems": MAX_BULK_SIZE}
+
+def check_review(review: ReviewPOSTRequest) -> ReviewPOSTRequest:
+    """Function that strips a decoded review and checks its length"""
+    review.text = review.text.strip()
+    if not 1 <= len(review.text) <= MAX_REVIEW_LENGTH:
+        raise RequestValidationError([{"type": "string_length", "loc": ("body", "text"), "msg": "Invalid length"}])
+
+    return review
+
+async def parse_review(request: Request) -> ReviewPOSTRequest:
+    """Function that decodes and validates a review straight from the request body with msgspec"""
+    try:
+        review = review_decoder.decode(await request.body())
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": str(exc)}])
+
+    return check_review(review)
+
+async def parse_reviews(request: Request) -> list[ReviewPOSTRequest]:
+    """Function that decodes and validates a list of reviews straight from the request body with msgspec"""
+    try:
+        reviews = reviews_decoder.decode(await request.body())
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": str(exc)}])
+
+    if not 1 <= len(reviews) <= MAX_BULK_SIZE:
+        raise RequestValidationError([{"type": "too_long", "loc": ("body",), "msg": "Invalid number of reviews"}])
+
+    return [check_review(review) for review in reviews]
+
+# DataBase
+async def connect_db() -> aiosqlite.Connection:
+    """Function that opens a connection to the database, tuned for WAL without an fsync per commit"""
+    conn = await aiosqlite.connect(DB_PATH)
+    for pragma in sqlite_pragmas:
+        await conn.execute(pragma)
+    return conn
+
+async def get_db() -> aiosqlite.Connection:
+    """A function that returns the shared connection for subsequent reads from a database."""
+    return app.state.db
+
+async def write_reviews(conn: aiosqlite.Connection, insert_queue: asyncio.Queue):
+    """Function that writes queued reviews to the database, one transaction and one commit per batch.
+
+    Each queue item is a list of (text, sentiment) pairs with a future, which receives
+    (ids, created_at) once the whole batch is committed. Reviews that arrive while a batch
+    is being committed wait in the queue and go out together with the next one, so a batch
+    grows with the load and never waits for a timer. A batch is written by multi-row INSERTs
+    of up to INSERT_BATCH_SIZE reviews each, and every review of it gets the same created_at.
+    All writes go through this single long-lived connection, as SQLite serializes them anyway.
+    """
+    while True:
+        batch = [await insert_queue.get()]
+        batch_size = len(batch[0][0])
+        while batch_size < INSERT_BATCH_SIZE and not insert_queue.empty():
+            batch.append(insert_queue.get_nowait())
+            batch_size += len(batch[-1][0])
+
+        # Whatever goes wrong with a batch fails only its own reviews, the loop has to keep running
+        try:
+            created_at = datetime.now(timezone.utc).isoformat()
+            rows = [(review_text, sentiment, created_at)
+                    for reviews, _ in batch for review_text, sentiment in reviews]
+
+            inserted = []
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                chunk = rows[start:start + INSERT_BATCH_SIZE]
+                inserted += await conn.execute_fetchall(
+                    insert_reviews_sql(len(chunk)), [value for row in chunk for value in row])
+            await conn.commit()
+            # SQLite does not promise the order of RETURNING rows, but it assigns ids in VALUES order
+            inserted_ids = sorted(row[0] for row in inserted)
+        except Exception as exc:
+            try:
+                await conn.rollback()
+            except Exception as rollback_exc:
+                logger.error("Failed to roll back a batch of reviews", exc_info=rollback_exc)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            continue
+
+        start = 0
+        for reviews, future in batch:
+            if not future.done():
+                future.set_result((inserted_ids[start:start + len(reviews)], created_at))
+            start += len(reviews)
+
+def writer_stopped(writer: asyncio.Task):
+    """Function that reports a review writer that stopped unexpectedly and fails the reviews still queued for it"""
+    if writer.cancelled():
+        return
+
+    logger.critical("Review writer stopped, new reviews can not be saved", exc_info=writer.exception())
+    insert_queue = app.state.insert_queue
+    while not insert_queue.empty():
+        _, future = insert_queue.get_nowait()
+        if not future.done():
+            future.set_exception(HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE))
+
+async def queue_reviews(reviews: list[tuple[str, str]]) -> tuple[list[int], str]:
+    """Function that hands (text, sentiment) pairs to write_reviews and waits for their ids and created_at"""
+    if app.state.writer.done():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    inserted = asyncio.get_running_loop().create_future()
+    await app.state.insert_queue.put((reviews, inserted))
+    return await inserted
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info(f"DataBase initialized")
+    writer_db = await connect_db()
+    for statement in schema_sql:
+        await writer_db.execute(statement)
+    await writer_db.commit()
+    logger.info(f"DataBase initialized")
+
+    app.state.db = await connect_db()
+    app.state.insert_queue = asyncio.Queue()
+    app.state.writer = asyncio.create_task(write_reviews(writer_db, app.state.insert_queue))
+    app.state.writer.add_done_callback(writer_stopped)
     yield
+    app.state.writer.cancel()
+    # wait() does not re-raise, so a writer that already crashed does not break the shutdown
+    await asyncio.wait([app.state.writer])
+    await writer_db.close()
+    await app.state.db.close()
 
 # Application
 app = FastAPI(
     title="Review Sentiment Service",
     description="Service for receiving reviews and conducting segment analysis",
     version="1.0.1",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -83,24 +266,74 @@ app.add_middleware(
 )
 
 # Third Party Features
+@lru_cache(maxsize=SENTIMENT_CACHE_SIZE)
+def analyze_review(text: str) -> tuple[str, str]:
+    """Function to strip HTML from a review and check it for trigger words, repeated reviews come from the cache.
+
+    The HTML parser only runs when the text has something for it to strip.
+    """
+    clear_text = text
+    if markup_re.search(text) is not None:
+        clear_text = sanitize_html(text, tags=[], attributes=[], strip=True)
+
+    return clear_text, check_sentiment(clear_text)
+
 def check_sentiment(text: str) -> str:
     """Function to check a string for trigger words"""
-    lower_text = text.lower()
+    # str.isascii() reads a flag CPython keeps on every string, it does not scan the text
+    if ascii_is_neutral and text.isascii():
+        return "neutral"
+
+    trigger = trigger_re.search(text)
+    if trigger is None:
+        return "neutral"
+
+    # A positive word wins even when it comes after a negative one
+    if trigger.lastgroup == "positive" or positive_re.search(text, trigger.end()):
+        return "positive"
 
-    for pattern in positive_patterns:
-        if re.search(pattern, lower_text):
-            return "positive"
+    return "negative"
 
-    for pattern in negative_patterns:
-        if re.search(pattern, lower_text):
-            return "negative"
+def encode_reviews(reviews: list) -> bytes:
+    """Function that encodes rows of reviews as the comma-separated items of a JSON array"""
+    # Rows come from our own table: plain dicts unpacked by position beat any per-row model here
+    return orjson.dumps([{
+        "id": review_id,
+        "text": review_text,
+        "sentiment": review_sentiment,
+        "created_at": created_at
+    }
+        for review_id, review_text, review_sentiment, created_at in reviews])[1:-1]
+
+async def fetch_reviews(db: aiosqlite.Connection, sentiment: str | None, cursor: int, limit: int) -> list:
+    """Function that reads up to limit reviews with id greater than cursor, running the query to completion"""
+    if sentiment:
+        return await db.execute_fetchall(SELECT_REVIEWS_BY_SENTIMENT_SQL, (sentiment, cursor, limit))
 
-    return "neutral"
+    return await db.execute_fetchall(SELECT_REVIEWS_SQL, (cursor, limit))
+
+async def stream_reviews(db: aiosqlite.Connection, sentiment: str | None, reviews: list, limit: int | None):
+    """Function that streams reviews as a JSON array, holding a single fetched batch in memory at a time.
+
+    Every batch is its own keyset query read to the end, so no statement stays open between yields:
+    an open one would pin the read snapshot of the shared connection and block WAL checkpoints.
+    """
+    yield b"[" + encode_reviews(reviews)
+    remaining = None if limit is None else limit - len(reviews)
+    # A short batch means the table (or the limit) is exhausted
+    while len(reviews) == FETCH_BATCH_SIZE and remaining != 0:
+        batch_size = FETCH_BATCH_SIZE if remaining is None else min(FETCH_BATCH_SIZE, remaining)
+        reviews = await fetch_reviews(db, sentiment, reviews[-1][0], batch_size)
+        if remaining is not None:
+            remaining -= len(reviews)
+        if reviews:
+            yield b"," + encode_reviews(reviews)
+    yield b"]"
 
 #Errors
-@app.exception_handler(SQLAlchemyError)
-async def db_exception_handler(request: Request, exc: SQLAlchemyError):
-    logger.error("SQLAlchemy Error", exc_info=exc)
+@app.exception_handler(aiosqlite.Error)
+async def db_exception_handler(request: Request, exc: aiosqlite.Error):
+    logger.error("SQLite Error", exc_info=exc)
     return JSONResponse(status_code=500, content={"detail": "Internal database error"})
 
 @app.exception_handler(RequestValidationError)
@@ -124,67 +357,64 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     )
 
 # Endpoints
-@app.post("/reviews", response_model=ReviewResponse, status_code=status.HTTP_201_CREATED)
-async def create_review(
-        request: ReviewPOSTRequest,
-        db: AsyncSession = Depends(get_db)
-):
+# Responses are built from already known-good values and returned as is: ReviewResponse only documents them
+@app.post("/reviews", status_code=status.HTTP_201_CREATED, responses={
+    status.HTTP_201_CREATED: {"model": ReviewResponse}}, openapi_extra={
+    "requestBody": {"required": True, "content": {"application/json": {"schema": review_schema}}}})
+async def create_review(request: ReviewPOSTRequest = Depends(parse_review)) -> ORJSONResponse:
     """Function for creating and checking a review"""
-    clear_text = sanitize_html(request.text, tags=[], attributes=[], strip=True)
-    sentiment = check_sentiment(clear_text)
-    created_at = datetime.now(timezone.utc).isoformat()
+    clear_text, sentiment = analyze_review(request.text)
 
-    insert_review_sql = text("""
-        INSERT INTO reviews (text, sentiment, created_at)
-        VALUES (:text, :sentiment, :created_at)
-        """)
-    await db.execute(insert_review_sql, {
+    # The review is committed (and timestamped) by write_reviews together with the other queued ones
+    (last_id,), created_at = await queue_reviews([(clear_text, sentiment)])
+
+    return ORJSONResponse({
+        "id": last_id,
         "text": clear_text,
         "sentiment": sentiment,
         "created_at": created_at
-    })
-    await db.commit()
-    last_id_result = await db.execute(text("SELECT last_insert_rowid()"))
-    last_id = last_id_result.scalar()
-
-    return ReviewResponse(
-        id=last_id,
-        text=clear_text,
-        sentiment=sentiment,
-        created_at=created_at)
-
-@app.get("/reviews", response_model=list[ReviewResponse])
+    }, status_code=status.HTTP_201_CREATED)
+
+@app.post("/reviews/bulk", status_code=status.HTTP_201_CREATED, responses={
+    status.HTTP_201_CREATED: {"model": list[ReviewResponse]}}, openapi_extra={
+    "requestBody": {"required": True, "content": {"application/json": {"schema": reviews_schema}}}})
+async def create_reviews(requests: list[ReviewPOSTRequest] = Depends(parse_reviews)) -> ORJSONResponse:
+    """Function for creating and checking a list of reviews, all of them are committed in one transaction"""
+    reviews = [analyze_review(request.text) for request in requests]
+
+    inserted_ids, created_at = await queue_reviews(reviews)
+
+    return ORJSONResponse([{
+        "id": review_id,
+        "text": clear_text,
+        "sentiment": sentiment,
+        "created_at": created_at
+    }
+        for review_id, (clear_text, sentiment) in zip(inserted_ids, reviews)], status_code=status.HTTP_201_CREATED)
+
+@app.get("/reviews", responses={status.HTTP_200_OK: {"model": list[ReviewResponse]}})
 async def list_reviews(
         sentiment: str | None = Query(
             None,
             pattern="^(positive|negative|neutral)$", description="Filter by sentiment"),
-        db: AsyncSession = Depends(get_db)
-):
+        cursor: int = Query(0, ge=0, le=MAX_ID, description="Return only reviews with id greater than this one"),
+        limit: int | None = Query(None, ge=1, le=MAX_ID, description="Maximum number of reviews to return"),
+        db: aiosqlite.Connection = Depends(get_db)
+) -> StreamingResponse:
     """Function to get a list of reviews"""
-    if sentiment:
-        reviews_sql = text("""
-        SELECT id, text, sentiment, created_at 
-        FROM reviews 
-        WHERE sentiment = :sentiment
-        """)
-        result = await db.execute(reviews_sql, {"sentiment": sentiment})
-    else:
-        reviews_sql = text("""
-                SELECT id, text, sentiment, created_at 
-                FROM reviews 
-                """)
-        result = await db.execute(reviews_sql)
-
-    reviews = result.fetchall()
-    return [ReviewResponse(
-        id=review.id,
-        text=review.text,
-        sentiment=review.sentiment,
-        created_at=review.created_at
-    )
-        for review in reviews]
+    # The first batch is fetched before the response starts, so database errors still end up as a 500
+    reviews = await fetch_reviews(db, sentiment, cursor, min(FETCH_BATCH_SIZE, limit or FETCH_BATCH_SIZE))
+
+    return StreamingResponse(stream_reviews(db, sentiment, reviews, limit), media_type="application/json")
 
 # Running the application locally
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, log_level="info", reload=True)
\ No newline at end of file
+    # uvicorn picks uvloop and httptools on its own when they are installed (uvloop has no Windows build)
+    uvicorn.run(
+        "main:app",
+        host="127.0.0.1",
+        port=8000,
+        log_level=LOG_LEVEL.lower(),
+        reload=RELOAD,
+        workers=1 if RELOAD else WORKERS)
\ No newline at end of file